@@ -0,0 +1,128 @@
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+from global_variables import STAMP_CACHE_SIZE
+
+
+# (size, hardness, shape) -> stamp, least recently used first
+_stamps = OrderedDict()
+
+
+def stamp(size, hardness, shape="round"):
+    key = (size, hardness, shape)
+    a = _stamps.get(key)
+    if a is not None:
+        _stamps.move_to_end(key)
+        return a
+
+    a = make_stamp(size, hardness, shape)
+    _stamps[key] = a
+    if len(_stamps) > STAMP_CACHE_SIZE:
+        _stamps.popitem(last=False)
+    return a
+
+
+def stamp_cache_bytes():
+    return sum(a.nbytes for a in _stamps.values())
+
+
+def make_stamp(size, hardness, shape="round"):
+    # Coverage (0..1) of a single dab, `size` pixels across. `hardness` is the
+    # percentage of the radius painted at full strength before the falloff.
+    c = np.arange(size, dtype=np.float32) - (size - 1) / 2.0
+    if shape == "square":
+        d = np.maximum(np.abs(c)[:, None], np.abs(c)[None, :])
+    else:
+        d = np.hypot(c[:, None], c[None, :])
+    d /= size / 2.0
+
+    inner = hardness / 100.0
+    t = np.clip((d - inner) / max(1.0 - inner, 1e-3), 0.0, 1.0)
+    a = 1.0 - t * t * (3.0 - 2.0 * t)
+    a[d >= 1.0] = 0.0
+
+    # Shared between callers through the cache, so keep it immutable
+    a.setflags(write=False)
+    return a
+
+
+def dab_positions(p1, p2, spacing, offset):
+    # Dab centres every `spacing` pixels from p1 towards p2. `offset` is the
+    # distance still to travel before the next dab; the new one is returned.
+    dx, dy = p2.x() - p1.x(), p2.y() - p1.y()
+    length = math.hypot(dx, dy)
+    if length == 0 and offset == 0:
+        return np.array([[p1.x(), p1.y()]], dtype=np.int32), spacing
+    if length == 0 or length <= offset:
+        return np.empty((0, 2), dtype=np.int32), offset - length
+
+    t = np.arange(offset, length, spacing, dtype=np.float32)
+    pts = np.empty((len(t), 2), dtype=np.int32)
+    pts[:, 0] = np.rint(p1.x() + dx * t / length)
+    pts[:, 1] = np.rint(p1.y() + dy * t / length)
+    return pts, spacing - (length - t[-1])
+
+
+def blend_dabs(arr, pts, dab, color):
+    # Composite the dabs of a stroke segment into `arr` (BGRA, modified in
+    # place). Consecutive dabs are blended together in groups spanning at
+    # most two dab widths, so the temporaries stay small however long the
+    # segment is. Returns the touched (x, y, w, h) or None.
+    s = dab.shape[0]
+    xs = pts[:, 0] - s // 2
+    ys = pts[:, 1] - s // 2
+
+    dirty = None
+    start = 0
+    x_lo = x_hi = xs[0]
+    y_lo = y_hi = ys[0]
+    for i in range(1, len(xs) + 1):
+        if i < len(xs):
+            x_lo, x_hi = min(x_lo, xs[i]), max(x_hi, xs[i])
+            y_lo, y_hi = min(y_lo, ys[i]), max(y_hi, ys[i])
+            if x_hi - x_lo <= s and y_hi - y_lo <= s:
+                continue
+
+        r = _blend_group(arr, xs[start:i], ys[start:i], dab, color)
+        if r and dirty:
+            x0, y0 = min(r[0], dirty[0]), min(r[1], dirty[1])
+            x1 = max(r[0] + r[2], dirty[0] + dirty[2])
+            y1 = max(r[1] + r[3], dirty[1] + dirty[3])
+            dirty = (x0, y0, x1 - x0, y1 - y0)
+        elif r:
+            dirty = r
+
+        if i < len(xs):
+            start = i
+            x_lo = x_hi = xs[i]
+            y_lo = y_hi = ys[i]
+
+    return dirty
+
+
+def _blend_group(arr, xs, ys, dab, color):
+    # One blend for a group of dabs: repeated "over" operations with one
+    # colour combine to a coverage of 1 - prod(1 - a_i)
+    h, w = arr.shape[:2]
+    s = dab.shape[0]
+
+    bx0, by0 = max(0, int(xs.min())), max(0, int(ys.min()))
+    bx1, by1 = min(w, int(xs.max()) + s), min(h, int(ys.max()) + s)
+    if bx0 >= bx1 or by0 >= by1:
+        return None
+
+    remain = np.ones((by1 - by0, bx1 - bx0), dtype=np.float32)
+    for x, y in zip(xs, ys):
+        x0, y0 = max(x, bx0), max(y, by0)
+        x1, y1 = min(x + s, bx1), min(y + s, by1)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        remain[y0 - by0:y1 - by0, x0 - bx0:x1 - bx0] *= 1.0 - dab[y0 - y:y1 - y, x0 - x:x1 - x]
+
+    region = arr[by0:by1, bx0:bx1]
+    cover = (1.0 - remain)[..., None]
+    out = region + (np.asarray(color, dtype=np.float32) - region) * cover
+    region[:] = out + 0.5
+    return bx0, by0, bx1 - bx0, by1 - by0
@@ -1,17 +1,25 @@
 import math
 import random
+import sys
 from collections import deque
 
-from PyQt5.QtCore import QPoint, Qt, QRect, QSize
-from PyQt5.QtGui import QMouseEvent, QPainter, QPen, QPixmap, QFontMetrics
+from PyQt5 import sip
+from PyQt5.QtCore import QPoint, Qt, QRect, QSize, pyqtSignal
+from PyQt5.QtGui import QMouseEvent, QPainter, QPen, QFontMetrics, QImage, QColor, QFont
 from PyQt5.QtWidgets import QWidget, QMessageBox, QInputDialog, QSizePolicy, QColorDialog, QFontDialog
 
-from functions import *
+from functions import (
+    qimage_view, numpy_to_qimage, stroke_rect, image_copy,
+    changed_rect, convolve, flood_fill, replace_color, magic_wand, box_blur_kernel, sharpen_kernel
+)
 from global_variables import *
 from text_item import TextItem
 
 
 class Canvas(QWidget):
+    image_changed = pyqtSignal()
+    job_finished = pyqtSignal(object, object)
+
     def __init__(self, w=CANVAS_W, h=CANVAS_H):
         super().__init__()
 
@@ -29,9 +37,21 @@ class Canvas(QWidget):
 
         self.pen_color = QColor("black")
         self.pen_width = 8
+        self.brush_hardness = 50
+        self.brush_shape = "round"
+        self.dab_offset = 0.0
         self.eraser_color = QColor(255, 255, 255)
 
         self.tool = "brush"
+        self.tolerance = 0
+        self.selection = None
+
+        # Memory-mapped pixels behind self.image after a raw load
+        self.image_buffer = None
+
+        # Set while a background job will replace the image
+        self.busy = False
+        self.job_finished.connect(self.finish_job)
 
         self.text_color = QColor("black")
         self.text_font = QFont("Arial", 20)
@@ -44,6 +64,15 @@ class Canvas(QWidget):
 
         self.undo_stack = deque(maxlen=UNDO_LIMIT)
         self.redo_stack = deque(maxlen=UNDO_LIMIT)
+        self.memory_budget = MEMORY_BUDGET
+
+        # Called once after the first paint (startup timing)
+        self.on_first_paint = None
+
+        # Created on the first statistics request, see image_stats()
+        self.histogram = None
+        # Created on the first filter, see apply_filter()
+        self.filter_cache = None
 
         self.push_undo()  # initial state
 
@@ -51,33 +80,59 @@ class Canvas(QWidget):
     # -------------------------- UNDO / REDO ---------------------------
     # ------------------------------------------------------------------
 
-    def push_undo(self):
+    def push_undo(self, shallow=False):
+        # A shallow state shares pixels with the current image until the
+        # next edit detaches it (QImage implicit sharing)
         self.undo_stack.append((
-            image_copy(self.image),
+            QImage(self.image) if shallow else image_copy(self.image),
             [item.copy() for item in self.text_items]
         ))
         self.redo_stack.clear()
+        self.enforce_memory_budget()
+        self.release_image_buffer()
+        self.image_changed.emit()
 
     def restore_state(self, state):
         img, items = state
+        old = self.image
         self.image = image_copy(img)
         self.text_items = [i.copy() for i in items]
         self.selected_text_item = None
+        # Only worth diffing once statistics are being kept
+        if self.histogram:
+            self.mark_dirty(changed_rect(old, self.image))
+        self.release_image_buffer()
+
+    def release_image_buffer(self):
+        # Drop a raw file mapping once neither the image nor any undo / redo
+        # state wraps it any more
+        if self.image_buffer is None:
+            return
+        address = self.image_buffer.ctypes.data
+        images = [self.image] + [img for img, _ in self.undo_stack] + [img for img, _ in self.redo_stack]
+        if not any(not img.isNull() and int(img.constBits()) == address for img in images):
+            self.image_buffer = None
 
     def undo(self):
+        if self.busy:
+            return
         if len(self.undo_stack) > 1:
             state = self.undo_stack.pop()
             self.redo_stack.append(state)
             self.restore_state(self.undo_stack[-1])
+            self.image_changed.emit()
             self.update()
         else:
             QMessageBox.information(self, "Undo", "No more undo steps.")
 
     def redo(self):
+        if self.busy:
+            return
         if self.redo_stack:
             state = self.redo_stack.pop()
             self.undo_stack.append(state)
             self.restore_state(state)
+            self.image_changed.emit()
             self.update()
         else:
             QMessageBox.information(self, "Redo", "No more redo steps.")
@@ -95,20 +150,52 @@ class Canvas(QWidget):
     def set_pen_width(self, w):
         self.pen_width = w
 
+    def set_brush_hardness(self, h):
+        self.brush_hardness = h
+
+    def set_brush_shape(self, s):
+        self.brush_shape = s
+
+    def set_tolerance(self, t):
+        self.tolerance = t
+
+    def clear_selection(self):
+        self.selection = None
+        self.update()
+
     # ------------------------------------------------------------------
     # -------------------------- MOUSE EVENTS --------------------------
     # ------------------------------------------------------------------
 
     def mousePressEvent(self, ev: QMouseEvent):
-        if ev.button() != Qt.LeftButton:
+        if ev.button() != Qt.LeftButton or self.busy:
+            return
+
+        # The widget can be larger than the image; the pixel-picking tools
+        # have nothing to pick outside it
+        if self.tool in ("bucket", "replace", "wand") and not self.image.rect().contains(ev.pos()):
             return
 
         if self.tool == "bucket":
-            self.image = flood_fill(self.image, ev.x(), ev.y(), self.pen_color)
+            self.image, filled = flood_fill(self.image, ev.x(), ev.y(), self.pen_color)
+            self.mark_dirty(filled)
+            self.push_undo()
+            self.update()
+            return
+
+        if self.tool == "replace":
+            within = self.selection.mask(self.image.width(), self.image.height()) if self.selection else None
+            self.image, replaced = replace_color(self.image, ev.x(), ev.y(), self.pen_color, self.tolerance, within)
+            self.mark_dirty(replaced)
             self.push_undo()
             self.update()
             return
 
+        if self.tool == "wand":
+            self.selection = magic_wand(self.image, ev.x(), ev.y(), self.tolerance)
+            self.update()
+            return
+
         if self.tool == "text_select":
             for item in reversed(self.text_items):
                 if item.bounding_rect.contains(ev.pos()):
@@ -135,7 +222,11 @@ class Canvas(QWidget):
 
         self.drawing = True
         self.start_point = ev.pos()
-        self.draw_point(ev.pos())
+        if self.tool == "soft_brush":
+            self.dab_offset = 0.0
+            self.draw_dabs(ev.pos(), ev.pos())
+        else:
+            self.draw_point(ev.pos())
         self.update()
 
     def mouseMoveEvent(self, ev: QMouseEvent):
@@ -165,6 +256,10 @@ class Canvas(QWidget):
             self.draw_line(self.start_point, pos, self.pen_color, self.pen_width)
             self.start_point = pos
 
+        elif self.tool == "soft_brush":
+            self.draw_dabs(self.start_point, pos)
+            self.start_point = pos
+
         elif self.tool == "airbrush":
             self.airbrush_point(pos, self.pen_color, self.pen_width)
 
@@ -173,6 +268,8 @@ class Canvas(QWidget):
             self.start_point = pos
 
         elif self.tool in ("line", "rect", "ellipse"):
+            # Restoring from temp also reverts the previous preview
+            self.mark_dirty(stroke_rect(self.start_point, self.end_point, self.pen_width))
             self.end_point = pos
             self.image = image_copy(self.temp)
             self.draw_shape_preview(self.start_point, self.end_point)
@@ -193,13 +290,14 @@ class Canvas(QWidget):
 
         if self.tool in ("line", "rect", "ellipse"):
             self.draw_shape_final(self.start_point, ev.pos())
+            self.temp = QImage()  # preview backup is only needed while dragging
 
         self.drawing = False
         self.push_undo()
         self.update()
 
     def mouseDoubleClickEvent(self, ev):
-        if self.tool != "text_select":
+        if self.tool != "text_select" or self.busy:
             return
 
         for item in reversed(self.text_items):
@@ -247,6 +345,9 @@ class Canvas(QWidget):
         painter = QPainter(self)
         painter.drawImage(0, 0, self.image)
 
+        if self.selection:
+            painter.drawImage(0, 0, self.selection.overlay())
+
         for item in self.text_items:
             painter.setPen(QPen(item.color))
             painter.setFont(item.font)
@@ -258,6 +359,10 @@ class Canvas(QWidget):
             painter.setBrush(Qt.NoBrush)
             painter.drawRect(self.selected_text_item.bounding_rect)
 
+        if self.on_first_paint:
+            callback, self.on_first_paint = self.on_first_paint, None
+            callback()
+
     # ------------------------------------------------------------------
     # --------------------------- DRAWING ------------------------------
     # ------------------------------------------------------------------
@@ -268,6 +373,7 @@ class Canvas(QWidget):
         painter.setPen(pen)
         painter.drawPoint(pos)
         painter.end()
+        self.mark_dirty(stroke_rect(pos, pos, self.pen_width))
 
     def draw_line(self, p1, p2, color, width):
         painter = QPainter(self.image)
@@ -275,6 +381,23 @@ class Canvas(QWidget):
         painter.setPen(pen)
         painter.drawLine(p1, p2)
         painter.end()
+        self.mark_dirty(stroke_rect(p1, p2, width))
+
+    def draw_dabs(self, p1, p2):
+        from brush import stamp, dab_positions, blend_dabs
+
+        size = max(1, self.pen_width)
+        spacing = max(1.0, size * BRUSH_SPACING)
+        pts, self.dab_offset = dab_positions(p1, p2, spacing, self.dab_offset)
+        if not len(pts):
+            return
+
+        c = self.pen_color
+        dirty = blend_dabs(qimage_view(self.image, writable=True), pts,
+                           stamp(size, self.brush_hardness, self.brush_shape),
+                           (c.blue(), c.green(), c.red(), c.alpha()))
+        if dirty:
+            self.mark_dirty(QRect(*dirty))
 
     def airbrush_point(self, pos, color, width):
         radius = width * 1.6
@@ -291,6 +414,7 @@ class Canvas(QWidget):
             )
 
         painter.end()
+        self.mark_dirty(stroke_rect(pos, pos, radius))
 
     # ------------------------------------------------------------------
     # ---------------------------- SHAPES ------------------------------
@@ -310,6 +434,7 @@ class Canvas(QWidget):
             painter.drawEllipse(rect)
 
         painter.end()
+        self.mark_dirty(stroke_rect(p1, p2, self.pen_width))
 
     def draw_shape_final(self, p1, p2):
         self.draw_shape_preview(p1, p2)
@@ -330,69 +455,255 @@ class Canvas(QWidget):
     # -------------------------- FILTERS -------------------------------
     # ------------------------------------------------------------------
 
-    def apply_brightness(self, delta):
-        arr = qimage_to_numpy(self.image).astype(np.int16)
+    def within_selection(self, new_img):
+        # Keep filter output only inside the active selection
+        if not self.selection:
+            return new_img
+
+        mask = self.selection.mask(self.image.width(), self.image.height())
+        arr = qimage_view(self.image).copy()
+        arr[mask] = qimage_view(new_img)[mask]
+        return numpy_to_qimage(arr)
+
+    def apply_filter(self, op, params, fn, halo=0):
+        # Runs fn over the image through the filter cache, so bands whose
+        # input was already filtered the same way are reused (undo, redo,
+        # toggling parameters). `params` must be hashable.
+        if self.busy:
+            return
+        if self.filter_cache is None:
+            from filter_cache import FilterCache
+            self.filter_cache = FilterCache()
 
-        arr[..., :3] += delta
-        np.clip(arr, 0, 255, out=arr)
+        arr = self.filter_cache.apply(qimage_view(self.image), op, params, fn, halo)
 
-        self.image = numpy_to_qimage(arr.astype(np.uint8))
+        self.image = self.within_selection(numpy_to_qimage(arr))
+        self.mark_dirty()
         self.push_undo()
         self.update()
 
+    def apply_brightness(self, delta):
+        import numpy as np
+
+        def brightness(arr):
+            arr = arr.astype(np.int16)
+            arr[..., :3] += delta
+            np.clip(arr, 0, 255, out=arr)
+            return arr.astype(np.uint8)
+
+        self.apply_filter("brightness", delta, brightness)
+
     def apply_contrast(self, factor):
-        arr = qimage_to_numpy(self.image).astype(np.float32)
+        import numpy as np
 
-        arr[..., :3] = (arr[..., :3] - 128.0) * factor + 128.0
-        np.clip(arr, 0, 255, out=arr)
+        def contrast(arr):
+            arr = arr.astype(np.float32)
+            arr[..., :3] = (arr[..., :3] - 128.0) * factor + 128.0
+            np.clip(arr, 0, 255, out=arr)
+            return arr.astype(np.uint8)
 
-        self.image = numpy_to_qimage(arr.astype(np.uint8))
-        self.push_undo()
-        self.update()
+        self.apply_filter("contrast", factor, contrast)
+
+    def apply_auto_levels(self, clip=0.005):
+        from histogram import levels_from_histogram, levels_lut
+
+        if self.busy:
+            return
+        self.image_stats()
+
+        # Stretch each colour channel between its clipped darkest and brightest level
+        levels = tuple(levels_from_histogram(self.histogram.total[c], clip) for c in range(3))
+
+        def auto_levels(arr):
+            arr = arr.copy()
+            for c, (low, high) in enumerate(levels):
+                arr[..., c] = levels_lut(low, high)[arr[..., c]]
+            return arr
+
+        self.apply_filter("levels", levels, auto_levels)
+
+    def apply_rank_filter(self, kind, radius):
+        import rank_filters
+        filters = {
+            "median": rank_filters.median_filter,
+            "min": rank_filters.min_filter,
+            "max": rank_filters.max_filter,
+        }
+        self.apply_filter(kind, radius, lambda arr: filters[kind](arr, radius), halo=radius)
 
     def apply_blur(self, radius=3):
         k = box_blur_kernel(radius)
         factor = 1.0 / (radius * radius)
-        self.image = apply_kernel(self.image, k, factor=factor, offset=0)
-        self.push_undo()
-        self.update()
+        self.apply_kernel_filter(k, factor)
 
     def apply_sharpen(self):
         k = sharpen_kernel()
-        self.image = apply_kernel(self.image, k, factor=1.0, offset=0)
-        self.push_undo()
-        self.update()
+        self.apply_kernel_filter(k, 1.0)
+
+    def apply_kernel_filter(self, kernel, factor=1.0, offset=0):
+        params = (tuple(map(tuple, kernel)), factor, offset)
+        self.apply_filter("kernel", params, lambda arr: convolve(arr, kernel, factor, offset),
+                          halo=len(kernel) // 2)
+
+
+    # ------------------------------------------------------------------
+    # ------------------------- STATISTICS -----------------------------
+    # ------------------------------------------------------------------
+
+    def mark_dirty(self, rect=None):
+        if self.histogram:
+            self.histogram.mark_dirty(rect)
+
+    def image_stats(self):
+        # Recounts only the tiles touched since the last call
+        if self.histogram is None:
+            from histogram import TileHistogram
+            self.histogram = TileHistogram()
+        self.histogram.update(qimage_view(self.image))
+        return self.histogram.total, self.histogram.stats()
+
+    # ------------------------------------------------------------------
+    # --------------------------- MEMORY -------------------------------
+    # ------------------------------------------------------------------
+
+    def memory_usage(self):
+        from memory import image_bytes, text_items_bytes, state_bytes
+
+        # Images sharing pixels (a shallow undo state) are only counted once
+        seen = set()
+        temporaries = image_bytes(self.temp)
+        if self.selection:
+            temporaries += self.selection.bits.nbytes + image_bytes(self.selection.overlay_image)
+        if self.histogram and self.histogram.tiles is not None:
+            temporaries += self.histogram.tiles.nbytes
+        # Only loaded once the soft brush has been used
+        if "brush" in sys.modules:
+            temporaries += sys.modules["brush"].stamp_cache_bytes()
+
+        return {
+            "image": image_bytes(self.image, seen) + text_items_bytes(self.text_items),
+            "undo": sum(state_bytes(s, seen) for s in self.undo_stack),
+            "redo": sum(state_bytes(s, seen) for s in self.redo_stack),
+            "temporaries": temporaries,
+            "filter cache": self.filter_cache.nbytes if self.filter_cache else 0,
+        }
+
+    def set_memory_budget(self, n):
+        self.memory_budget = n
+        self.enforce_memory_budget()
+        self.release_image_buffer()
+        self.image_changed.emit()
+
+    def enforce_memory_budget(self):
+        def over():
+            return sum(self.memory_usage().values()) - self.memory_budget
+
+        if over() <= 0:
+            return
 
+        # Give up what is cheapest to lose first: cached filter output, then
+        # the furthest redo steps, then the oldest undo steps. The current
+        # state always stays on the undo stack. Usage is recounted after each
+        # step, a state sharing pixels with one that is kept frees nothing.
+        if self.filter_cache:
+            self.filter_cache.trim(max(0, self.filter_cache.nbytes - over()))
+        while self.redo_stack and over() > 0:
+            self.redo_stack.popleft()
+        while len(self.undo_stack) > 1 and over() > 0:
+            self.undo_stack.popleft()
+
+    def memory_report(self):
+        from memory import report
+
+        details = {
+            "undo steps": len(self.undo_stack),
+            "redo steps": len(self.redo_stack),
+            "text items": len(self.text_items),
+            "filter cache bands": len(self.filter_cache.entries) if self.filter_cache else 0,
+            "filter cache hits / misses": "%d / %d" % (
+                (self.filter_cache.hits, self.filter_cache.misses) if self.filter_cache else (0, 0)),
+        }
+        return report(self.memory_usage(), self.memory_budget, details)
 
     # ------------------------------------------------------------------
     # ----------------------- IMAGE IO ---------------------------------
     # ------------------------------------------------------------------
 
     def load_image(self, path):
+        if self.busy:
+            return
+        if path.lower().endswith(".npy"):
+            self.load_raw(path)
+            return
+
+        from resample import resize_async
+
         loaded = QImage(path)
         if loaded.isNull():
             QMessageBox.critical(self, "Load", "Failed to load image")
             return
 
-        self.image = QImage(self.width(), self.height(), QImage.Format_ARGB32)
+        # Fit into the visible canvas. The widget may not be laid out yet at
+        # startup, and after a downscale it is larger than the image.
+        w = max(self.image.width(), self.width())
+        h = max(self.image.height(), self.height())
+        scale = min(w / loaded.width(), h / loaded.height())
+        fit_w = max(1, round(loaded.width() * scale))
+        fit_h = max(1, round(loaded.height() * scale))
+
+        loaded = loaded.convertToFormat(QImage.Format_ARGB32)
+        src = qimage_view(loaded).copy()
+        self.run_in_background(resize_async(src, fit_w, fit_h, "bilinear"),
+                               lambda arr: self.finish_load(arr, w, h))
+
+    def finish_load(self, arr, w, h):
+        self.image = QImage(w, h, QImage.Format_ARGB32)
         self.image.fill(QColor("white"))
 
         painter = QPainter(self.image)
-        pix = QPixmap.fromImage(loaded).scaled(
-            self.width(),
-            self.height(),
-            Qt.KeepAspectRatio,
-            Qt.SmoothTransformation
-        )
-        x = (self.width() - pix.width()) // 2
-        y = (self.height() - pix.height()) // 2
-        painter.drawPixmap(x, y, pix)
+        x = (w - arr.shape[1]) // 2
+        y = (h - arr.shape[0]) // 2
+        painter.drawImage(x, y, numpy_to_qimage(arr))
         painter.end()
 
+        self.mark_dirty()
         self.push_undo()
         self.update()
 
-    def save_image(self, path):
+    def load_raw(self, path):
+        import numpy as np
+
+        # Copy-on-write mapping: pages are read on first touch and painting
+        # goes to private copies, the file itself is never modified
+        try:
+            arr = np.load(path, mmap_mode="c")
+        except (OSError, ValueError):
+            arr = None
+
+        if (arr is None or arr.dtype != np.uint8 or arr.ndim != 3 or arr.shape[2] != 4
+                or arr.shape[0] == 0 or arr.shape[1] == 0):
+            QMessageBox.critical(self, "Load", "Failed to load image")
+            return
+        # Fortran-ordered files can't be wrapped row by row, read them into a copy
+        if not arr.flags.c_contiguous:
+            arr = np.ascontiguousarray(arr)
+
+        h, w = arr.shape[:2]
+        # The QImage wraps the buffer without copying, keep it alive
+        self.image_buffer = arr
+        self.image = QImage(sip.voidptr(arr.ctypes.data), w, h, w * 4, QImage.Format_ARGB32)
+        self.setMinimumSize(w, h)
+
+        # The first undo state shares the mapping rather than reading it all
+        self.mark_dirty()
+        self.push_undo(shallow=True)
+        self.update()
+
+    def flattened_image(self):
+        # Text items live on top of the image; only copy when there are any
+        if not self.text_items:
+            return self.image
+
         final = image_copy(self.image)
         painter = QPainter(final)
 
@@ -402,8 +713,26 @@ class Canvas(QWidget):
             painter.drawText(item.pos, item.text)
 
         painter.end()
+        return final
+
+    def save_image(self, path):
+        if path.lower().endswith(".npy"):
+            self.save_raw(path)
+            return
+
+        if not self.flattened_image().save(path):
+            QMessageBox.critical(self, "Save", "Failed to save image")
+
+    def save_raw(self, path):
+        import numpy as np
 
-        if not final.save(path):
+        # Raw BGRA pixels (ARGB32 in memory) written straight from the buffer
+        final = self.flattened_image()
+        try:
+            # Through a file object, so np.save doesn't append ".npy" to "x.NPY"
+            with open(path, "wb") as f:
+                np.save(f, qimage_view(final))
+        except OSError:
             QMessageBox.critical(self, "Save", "Failed to save image")
 
     # ------------------------------------------------------------------
@@ -421,11 +750,55 @@ class Canvas(QWidget):
             painter.end()
 
             self.image = new_img
+            self.mark_dirty()
+            self.image_changed.emit()
             self.update()
 
         super().resizeEvent(event)
 
+    def resize_image(self, w, h, method="bilinear"):
+        from resample import resize_async
+
+        if self.busy:
+            return
+
+        # Scales the picture itself, unlike set_canvas_size
+        src = qimage_view(self.image).copy()
+        self.run_in_background(resize_async(src, w, h, method), self.finish_resize)
+
+    def finish_resize(self, arr):
+        # Inside the resizable scroll area a smaller image leaves the widget
+        # at viewport size, the area past the image is just background
+        h, w = arr.shape[:2]
+        self.image = numpy_to_qimage(arr)
+        self.selection = None
+        self.setMinimumSize(w, h)
+
+        self.mark_dirty()
+        self.push_undo()
+        self.update()
+
+    def run_in_background(self, future, on_done):
+        # on_done(result) runs back on the GUI thread once the future is done.
+        # Anything that changes the image is refused meanwhile (see the busy
+        # checks), otherwise the result would overwrite it.
+        self.busy = True
+        self.setCursor(Qt.WaitCursor)
+        future.add_done_callback(lambda f: self.job_finished.emit(f, on_done))
+
+    def finish_job(self, future, on_done):
+        self.busy = False
+        self.unsetCursor()
+        try:
+            result = future.result()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", "Background job failed: %s" % e)
+            return
+        on_done(result)
+
     def set_canvas_size(self, w, h):
+        if self.busy:
+            return
         new_img = QImage(max(1, w), max(1, h), QImage.Format_ARGB32)
         new_img.fill(QColor("white"))
 
@@ -435,6 +808,8 @@ class Canvas(QWidget):
         painter.end()
 
         self.image = new_img
+        self.mark_dirty()
+        self.image_changed.emit()
 
         # Update widget minimum size to allow scrolling
         self.setMinimumSize(w, h)
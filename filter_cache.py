@@ -0,0 +1,68 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from global_variables import FILTER_CACHE_BYTES, FILTER_BAND
+
+
+# Memoises filter output per band of FILTER_BAND rows, keyed by the
+# operation, its parameters and a hash of the input pixels the band depends
+# on. Least recently used bands are dropped once the byte budget is reached.
+# Full-width bands keep the row-by-row filters (median) efficient, while an
+# edit only invalidates the bands it touches.
+class FilterCache:
+    def __init__(self, budget=FILTER_CACHE_BYTES, band=FILTER_BAND):
+        self.budget = budget
+        self.band = band
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def apply(self, arr, op, params, fn, halo=0):
+        # fn maps an (h, w, 4) array to one of the same shape, and output
+        # rows depend on input rows at most `halo` away
+        h = arr.shape[0]
+        out = np.empty(arr.shape, dtype=np.uint8)
+
+        for y0 in range(0, h, self.band):
+            y1 = min(h, y0 + self.band)
+            s0, s1 = max(0, y0 - halo), min(h, y1 + halo)
+            src = np.ascontiguousarray(arr[s0:s1])
+
+            digest = hashlib.blake2b(src, digest_size=16).digest()
+            key = (op, params, src.shape, y0 - s0, y1 - y0, digest)
+
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                cached = np.ascontiguousarray(fn(src)[y0 - s0:y1 - s0])
+                self.misses += 1
+                self.put(key, cached)
+
+            out[y0:y1] = cached
+
+        return out
+
+    def put(self, key, value):
+        if value.nbytes > self.budget:
+            return
+        self.entries[key] = value
+        self.nbytes += value.nbytes
+        self.trim(self.budget)
+
+    def trim(self, target):
+        # Evict least recently used bands down to `target` bytes, returns the bytes freed
+        freed = 0
+        while self.entries and self.nbytes > target:
+            _, old = self.entries.popitem(last=False)
+            self.nbytes -= old.nbytes
+            freed += old.nbytes
+        return freed
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
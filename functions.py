@@ -1,8 +1,12 @@
-import numpy as np
+from PyQt5.QtCore import QRect
 from PyQt5.QtGui import QColor, QImage, QFont
 
+# NumPy (and the modules built on it) is imported inside the functions that
+# need it so that starting the editor does not pay for it up front.
+
 
 def qimage_to_numpy(img: QImage):
+    import numpy as np
     img = img.convertToFormat(QImage.Format_ARGB32)
     w, h = img.width(), img.height()
     ptr = img.bits()
@@ -11,12 +15,45 @@ def qimage_to_numpy(img: QImage):
     return arr
 
 
-def numpy_to_qimage(arr: np.ndarray):
+def qimage_view(img: QImage, writable=False):
+    # Zero-copy view of an ARGB32 image; the image must outlive the array
+    import numpy as np
+    ptr = img.bits() if writable else img.constBits()
+    ptr.setsize(img.height() * img.bytesPerLine())
+    arr = np.frombuffer(ptr, np.uint8).reshape((img.height(), img.bytesPerLine() // 4, 4))
+    return arr[:, :img.width()]
+
+
+def numpy_to_qimage(arr):
     h, w, _ = arr.shape
     img = QImage(arr.data, w, h, QImage.Format_ARGB32)
     return img.copy()
 
 
+def stroke_rect(p1, p2, width):
+    # Area touched by a stroke from p1 to p2, grown by the pen width
+    w = int(width) + 1
+    return QRect(p1, p2).normalized().adjusted(-w, -w, w, w)
+
+
+def mask_rect(mask):
+    # Bounding QRect of the True pixels of a 2-D mask
+    import numpy as np
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return QRect()
+    cols = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+    return QRect(int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+
+
+def changed_rect(old: QImage, new: QImage):
+    # Area where two ARGB32 images differ, None if their sizes differ
+    if old.size() != new.size():
+        return None
+    a, b = qimage_view(old), qimage_view(new)
+    return mask_rect((a != b).any(axis=2))
+
+
 def clamp(v, a=0, b=255):
     return max(a, min(b, v))
 
@@ -37,7 +74,12 @@ def set_text_color(self, color: QColor):
 
 
 def apply_kernel(src_img: QImage, kernel, factor=1.0, offset=0):
-    arr = qimage_to_numpy(src_img).astype(np.float32)
+    return numpy_to_qimage(convolve(qimage_to_numpy(src_img), kernel, factor, offset))
+
+
+def convolve(arr, kernel, factor=1.0, offset=0):
+    import numpy as np
+    arr = arr.astype(np.float32)
     k = np.array(kernel, dtype=np.float32)
     kh, kw = k.shape
     pad = kh // 2
@@ -52,10 +94,11 @@ def apply_kernel(src_img: QImage, kernel, factor=1.0, offset=0):
     out = out * factor + offset
     np.clip(out, 0, 255, out=out)
 
-    return numpy_to_qimage(out.astype(np.uint8))
+    return out.astype(np.uint8)
 
 
 def flood_fill(img: QImage, x: int, y: int, new_color: QColor):
+    import numpy as np
     # Convert image to safe BGRA NumPy array
     img = img.convertToFormat(QImage.Format_ARGB32)
     w, h = img.width(), img.height()
@@ -75,7 +118,7 @@ def flood_fill(img: QImage, x: int, y: int, new_color: QColor):
     target_val = arr[y, x].copy()
 
     if np.array_equal(target_val, new_val):
-        return img
+        return img, QRect()
 
     mask = np.all(arr == target_val, axis=2)
     filled = np.zeros((h, w), dtype=bool)
@@ -100,7 +143,43 @@ def flood_fill(img: QImage, x: int, y: int, new_color: QColor):
 
     # Return a new QImage
     out_img = QImage(arr.data, w, h, QImage.Format_ARGB32)
-    return out_img.copy()
+    return out_img.copy(), mask_rect(filled)
+
+
+def color_mask(arr, color, tolerance=0):
+    import numpy as np
+    # Pixels whose every BGRA channel is within `tolerance` of `color`
+    mask = np.ones(arr.shape[:2], dtype=bool)
+    for c in range(4):
+        lo = max(0, int(color[c]) - tolerance)
+        hi = min(255, int(color[c]) + tolerance)
+        ch = arr[..., c]
+        mask &= (ch >= lo) & (ch <= hi)
+    return mask
+
+
+def replace_color(img: QImage, x: int, y: int, new_color: QColor, tolerance=0, within=None):
+    import numpy as np
+    # Non-contiguous counterpart of flood_fill: recolours every matching pixel
+    arr = qimage_view(img).copy()
+    new_val = np.array([new_color.blue(),
+                        new_color.green(),
+                        new_color.red(),
+                        new_color.alpha()],
+                        dtype=np.uint8)
+
+    mask = color_mask(arr, arr[y, x], tolerance)
+    if within is not None:
+        mask &= within
+    arr[mask] = new_val
+
+    return numpy_to_qimage(arr), mask_rect(mask)
+
+
+def magic_wand(img: QImage, x: int, y: int, tolerance=0):
+    from selection import Selection
+    arr = qimage_view(img)
+    return Selection(color_mask(arr, arr[y, x].copy(), tolerance))
 
 
 def box_blur_kernel(size):
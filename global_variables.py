@@ -1,2 +1,9 @@
 CANVAS_W, CANVAS_H = 1024, 720
-UNDO_LIMIT = 50
\ No newline at end of file
+UNDO_LIMIT = 50
+HIST_TILE = 128
+STAMP_CACHE_SIZE = 64
+BRUSH_SPACING = 0.15
+RESAMPLE_BAND = 64
+FILTER_BAND = 256
+FILTER_CACHE_BYTES = 256 * 1024 * 1024
+MEMORY_BUDGET = 2048 * 1024 * 1024
\ No newline at end of file
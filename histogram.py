@@ -0,0 +1,98 @@
+import numpy as np
+from PyQt5.QtCore import QRect
+
+from global_variables import HIST_TILE
+
+
+# Channel order of the ARGB32 buffer on little-endian machines
+CHANNELS = ("blue", "green", "red", "alpha")
+
+
+# Per-tile channel histograms of an ARGB32 image. Only tiles touched by
+# mark_dirty() are recounted on update(), the image-wide histogram is kept
+# as the running sum of all tiles.
+class TileHistogram:
+    def __init__(self, tile=HIST_TILE):
+        self.tile = tile
+        self.shape = None
+        self.tiles = None
+        self.total = np.zeros((4, 256), dtype=np.int64)
+        self.dirty = QRect()
+        self.dirty_all = True
+
+    def mark_dirty(self, rect=None):
+        # None means "everything", otherwise a QRect in image coordinates
+        if rect is None:
+            self.dirty_all = True
+        else:
+            self.dirty = self.dirty.united(rect)
+
+    def update(self, arr):
+        h, w = arr.shape[:2]
+        if self.shape != (h, w):
+            self.shape = (h, w)
+            self.tiles = np.zeros((-(-h // self.tile), -(-w // self.tile), 4, 256), dtype=np.int32)
+            self.total[:] = 0
+            self.dirty_all = True
+
+        if self.dirty_all:
+            ty0, ty1, tx0, tx1 = 0, self.tiles.shape[0], 0, self.tiles.shape[1]
+        else:
+            r = self.dirty.intersected(QRect(0, 0, w, h))
+            if r.isEmpty():
+                self.dirty = QRect()
+                return
+            ty0, ty1 = r.top() // self.tile, r.bottom() // self.tile + 1
+            tx0, tx1 = r.left() // self.tile, r.right() // self.tile + 1
+        self.dirty = QRect()
+        self.dirty_all = False
+
+        t = self.tile
+        x0, x1 = tx0 * t, min(w, tx1 * t)
+        col_tile = (np.arange(x1 - x0) // t).astype(np.int32) * 256
+        ncols = tx1 - tx0
+
+        # One bincount per channel and tile row, offset by tile index
+        for ty in range(ty0, ty1):
+            band = arr[ty * t:min(h, (ty + 1) * t), x0:x1]
+            old = self.tiles[ty, tx0:tx1]
+            self.total -= old.sum(axis=0)
+            for c in range(4):
+                idx = band[..., c] + col_tile
+                old[:, c] = np.bincount(idx.ravel(), minlength=ncols * 256).reshape(ncols, 256)
+            self.total += old.sum(axis=0)
+
+    def stats(self):
+        bins = np.arange(256, dtype=np.float64)
+        out = {}
+        for c, name in enumerate(CHANNELS):
+            hist = self.total[c]
+            n = hist.sum()
+            if n == 0:
+                out[name] = dict(mean=0.0, std=0.0, min=0, max=0, median=0)
+                continue
+            mean = (hist * bins).sum() / n
+            var = (hist * (bins - mean) ** 2).sum() / n
+            nz = np.flatnonzero(hist)
+            median = int(np.searchsorted(np.cumsum(hist), (n + 1) / 2))
+            out[name] = dict(mean=mean, std=var ** 0.5, min=int(nz[0]), max=int(nz[-1]), median=median)
+        return out
+
+
+def levels_from_histogram(hist, clip=0.005):
+    # Darkest / brightest levels after dropping `clip` of the pixels at each end
+    cdf = np.cumsum(hist)
+    n = cdf[-1]
+    if n == 0:
+        return 0, 255
+    low = int(np.searchsorted(cdf, n * clip, side="right"))
+    high = int(np.searchsorted(cdf, n * (1.0 - clip)))
+    return min(low, 255), min(high, 255)
+
+
+def levels_lut(low, high):
+    if high <= low:
+        return np.arange(256, dtype=np.uint8)
+    lut = (np.arange(256, dtype=np.float32) - low) * (255.0 / (high - low))
+    np.clip(lut, 0, 255, out=lut)
+    return (lut + 0.5).astype(np.uint8)
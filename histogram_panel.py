@@ -0,0 +1,89 @@
+import math
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPainter, QColor, QPainterPath
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton
+
+
+def _log(v):
+    return math.log(float(v)) if v > 0 else 0.0
+
+
+class HistogramView(QWidget):
+    # Drawn channels as (index into the BGRA histogram, colour)
+    CURVES = ((2, QColor(220, 40, 40, 110)), (1, QColor(40, 180, 40, 110)), (0, QColor(40, 80, 220, 110)))
+
+    def __init__(self):
+        super().__init__()
+        self.hist = None
+        self.setMinimumSize(256, 120)
+
+    def set_histogram(self, hist):
+        self.hist = hist
+        self.update()
+
+    def paintEvent(self, ev):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(30, 30, 30))
+        if self.hist is None:
+            return
+
+        w, h = self.width(), self.height()
+        # Log scale keeps a dominant background colour from flattening the rest
+        peak = max(1.0, float(self.hist[:3].max()))
+        scale = (h - 2) / (1.0 + _log(peak))
+
+        painter.setPen(Qt.NoPen)
+        for c, color in self.CURVES:
+            path = QPainterPath()
+            path.moveTo(0, h)
+            for v in range(256):
+                x = v * w / 256.0
+                y = h - (1.0 + _log(self.hist[c][v])) * scale if self.hist[c][v] else h
+                path.lineTo(x, y)
+                path.lineTo(x + w / 256.0, y)
+            path.lineTo(w, h)
+            painter.setBrush(color)
+            painter.drawPath(path)
+        painter.end()
+
+
+class HistogramPanel(QWidget):
+    def __init__(self, canvas):
+        super().__init__()
+        self.canvas = canvas
+
+        layout = QVBoxLayout(self)
+        self.view = HistogramView()
+        layout.addWidget(self.view)
+
+        self.stats_label = QLabel()
+        self.stats_label.setTextFormat(Qt.PlainText)
+        self.stats_label.setStyleSheet("font-family: monospace;")
+        layout.addWidget(self.stats_label)
+
+        levels_btn = QPushButton("Auto Levels")
+        levels_btn.clicked.connect(lambda: self.canvas.apply_auto_levels())
+        layout.addWidget(levels_btn)
+        layout.addStretch(1)
+
+        self.canvas.image_changed.connect(self.refresh)
+
+    def showEvent(self, ev):
+        self.refresh()
+        super().showEvent(ev)
+
+    def refresh(self):
+        # Hidden panels skip the work, showEvent catches up
+        if not self.isVisible():
+            return
+
+        hist, stats = self.canvas.image_stats()
+        self.view.set_histogram(hist)
+
+        lines = ["ch     mean    std  min  med  max"]
+        for name in ("red", "green", "blue", "alpha"):
+            s = stats[name]
+            lines.append("%-5s %6.1f %6.1f  %3d  %3d  %3d" % (
+                name[0].upper(), s["mean"], s["std"], s["min"], s["median"], s["max"]))
+        self.stats_label.setText("\n".join(lines))
@@ -1,10 +1,60 @@
+import time
+_T0 = time.perf_counter()
+
+import argparse
 import sys
 from PyQt5.QtWidgets import QApplication
 from main_window import MainWindow
 
+
+def parse_size(text):
+    try:
+        w, h = (int(v) for v in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected WIDTHxHEIGHT, e.g. 1920x1080")
+    if not (1 <= w <= 10000 and 1 <= h <= 10000):
+        raise argparse.ArgumentTypeError("width and height must be in 1..10000")
+    return w, h
+
+
+def parse_budget(text):
+    try:
+        mb = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a whole number of MB")
+    if mb < 1:
+        raise argparse.ArgumentTypeError("memory budget must be at least 1 MB")
+    return mb
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Mini Image Editor")
+    parser.add_argument("image", nargs="?", help="image to open at startup")
+    parser.add_argument("--size", type=parse_size, metavar="WxH",
+                        help="canvas size; skips the size dialogs (defaults to the image size)")
+    parser.add_argument("--memory-budget", type=parse_budget, metavar="MB",
+                        help="memory budget; undo history is trimmed to stay under it")
+    parser.add_argument("--timings", action="store_true",
+                        help="print import and first-paint times to stderr")
+    return parser.parse_args(argv)
+
+
 def main():
-    app = QApplication(sys.argv)
-    mw = MainWindow()
+    t_import = time.perf_counter()
+    args = parse_args(sys.argv[1:])
+
+    app = QApplication(sys.argv[:1])
+    mw = MainWindow(canvas_size=args.size, image_path=args.image)
+    if args.memory_budget is not None:
+        mw.canvas.set_memory_budget(args.memory_budget * 1024 * 1024)
+
+    if args.timings:
+        def report():
+            t_paint = time.perf_counter()
+            print("startup: imports %.1f ms, first paint %.1f ms" % (
+                (t_import - _T0) * 1000, (t_paint - _T0) * 1000), file=sys.stderr)
+        mw.canvas.on_first_paint = report
+
     mw.show()
     sys.exit(app.exec_())
 
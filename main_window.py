@@ -1,18 +1,25 @@
 import os
+import sys
 from PyQt5.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QAction, QActionGroup,
     QColorDialog, QFileDialog, QSpinBox, QToolBar,
-    QToolButton, QMenu, QScrollArea, QInputDialog
+    QToolButton, QMenu, QScrollArea, QInputDialog, QDockWidget,
+    QLabel, QMessageBox
 )
+from PyQt5.QtGui import QImageReader
+from PyQt5.QtCore import Qt
 
 from canvas import Canvas
+from histogram_panel import HistogramPanel
 from helpers import QInputDialogWithInt, QInputDialogWithFloat
 from global_variables import *
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, canvas_size=None, image_path=None):
         super().__init__()
+        self.canvas_size = canvas_size
+        self.image_path = image_path
 
         self.setWindowTitle("Mini Image Editor (PyQt5)")
         self.setGeometry(80, 80, CANVAS_W + 40, CANVAS_H + 80)
@@ -35,9 +42,36 @@ class MainWindow(QMainWindow):
         central.setLayout(layout)
         self.setCentralWidget(central)
 
-        # Show dialog to adjust canvas size
+        # Histogram / statistics panel, hidden until toggled from the toolbar
+        self.histogram_dock = QDockWidget("Histogram", self)
+        self.histogram_dock.setWidget(HistogramPanel(self.canvas))
+        self.addDockWidget(Qt.RightDockWidgetArea, self.histogram_dock)
+        self.histogram_dock.hide()
+
+        # Live memory use per subsystem
+        self.memory_label = QLabel()
+        self.statusBar().addPermanentWidget(self.memory_label)
+        self.canvas.image_changed.connect(self.update_memory_status)
+        self.update_memory_status()
+
         self.showMaximized()  # maximize window first
-        self.ask_canvas_size()
+
+        # Size from the command line or the image header, otherwise ask.
+        # Raw files always open at their own size.
+        raw = bool(self.image_path) and self.image_path.lower().endswith(".npy")
+        size = self.canvas_size
+        if size is None and self.image_path and not raw:
+            header = QImageReader(self.image_path).size()
+            if header.isValid():
+                size = (header.width(), header.height())
+
+        if size:
+            self.canvas.set_canvas_size(*size)
+        elif not raw:
+            self.ask_canvas_size()
+
+        if self.image_path:
+            self.canvas.load_image(self.image_path)
 
         self.create_toolbar()
 
@@ -62,9 +96,20 @@ class MainWindow(QMainWindow):
         # ---------- Draw tools ----------
         draw_menu = QMenu("Draw", self)
         draw_menu.addAction(make_tool("brush", "Brush"))
+        draw_menu.addAction(make_tool("soft_brush", "Soft Brush"))
         draw_menu.addAction(make_tool("airbrush", "Airbrush"))
         draw_menu.addAction(make_tool("eraser", "Eraser"))
 
+        # Dab shape for the soft brush
+        draw_menu.addSeparator()
+        shape_group = QActionGroup(self)
+        for shape, label in (("round", "Round Tip"), ("square", "Square Tip")):
+            act = QAction(label, self, checkable=True)
+            act.setChecked(shape == self.canvas.brush_shape)
+            act.triggered.connect(lambda _, s=shape: self.canvas.set_brush_shape(s))
+            shape_group.addAction(act)
+            draw_menu.addAction(act)
+
         draw_btn = QToolButton()
         draw_btn.setText("Draw")
         draw_btn.setMenu(draw_menu)
@@ -87,6 +132,9 @@ class MainWindow(QMainWindow):
         tb.addSeparator()
 
         tb.addAction(make_tool("bucket", "Bucket"))
+        tb.addAction(make_tool("replace", "Replace Color"))
+        tb.addAction(make_tool("wand", "Magic Wand"))
+        tb.addAction(QAction("Select None", self, triggered=self.canvas.clear_selection))
         tb.addAction(make_tool("text", "Text"))
         tb.addAction(make_tool("text_select", "Text Select"))
 
@@ -98,11 +146,26 @@ class MainWindow(QMainWindow):
         tb.addAction(color_act)
 
         size_spin = QSpinBox()
-        size_spin.setRange(1, 100)
+        size_spin.setRange(1, 500)
         size_spin.setValue(self.canvas.pen_width)
         size_spin.valueChanged.connect(self.canvas.set_pen_width)
         tb.addWidget(size_spin)
 
+        hard_spin = QSpinBox()
+        hard_spin.setRange(0, 100)
+        hard_spin.setPrefix("Hard ")
+        hard_spin.setSuffix("%")
+        hard_spin.setValue(self.canvas.brush_hardness)
+        hard_spin.valueChanged.connect(self.canvas.set_brush_hardness)
+        tb.addWidget(hard_spin)
+
+        tol_spin = QSpinBox()
+        tol_spin.setRange(0, 255)
+        tol_spin.setPrefix("Tol ")
+        tol_spin.setValue(self.canvas.tolerance)
+        tol_spin.valueChanged.connect(self.canvas.set_tolerance)
+        tb.addWidget(tol_spin)
+
         # ---------- Filters ----------
         tb.addSeparator()
 
@@ -111,6 +174,11 @@ class MainWindow(QMainWindow):
         filter_menu.addAction("Contrast", self.adjust_contrast_dialog)
         filter_menu.addAction("Blur", lambda: self.canvas.apply_blur(3))
         filter_menu.addAction("Sharpen", self.canvas.apply_sharpen)
+        filter_menu.addAction("Auto Levels", lambda: self.canvas.apply_auto_levels())
+        filter_menu.addSeparator()
+        filter_menu.addAction("Median...", lambda: self.rank_filter_dialog("median", "Median"))
+        filter_menu.addAction("Minimum (Erode)...", lambda: self.rank_filter_dialog("min", "Minimum"))
+        filter_menu.addAction("Maximum (Dilate)...", lambda: self.rank_filter_dialog("max", "Maximum"))
 
         filter_btn = QToolButton()
         filter_btn.setText("Filters")
@@ -118,6 +186,10 @@ class MainWindow(QMainWindow):
         filter_btn.setPopupMode(QToolButton.InstantPopup)
         tb.addWidget(filter_btn)
 
+        hist_act = self.histogram_dock.toggleViewAction()
+        hist_act.setText("Histogram")
+        tb.addAction(hist_act)
+
         # ---------- Undo / Redo ----------
         tb.addSeparator()
 
@@ -137,6 +209,10 @@ class MainWindow(QMainWindow):
         window_size_btn.setText("Settings")
         window_size_menu = QMenu("Settings", self)
         window_size_menu.addAction("Window Size", self.ask_canvas_size)
+        window_size_menu.addAction("Resize Image...", self.resize_image_dialog)
+        window_size_menu.addSeparator()
+        window_size_menu.addAction("Memory Budget...", self.memory_budget_dialog)
+        window_size_menu.addAction("Memory Report", self.show_memory_report)
         window_size_btn.setMenu(window_size_menu)
         window_size_btn.setPopupMode(QToolButton.InstantPopup)
         tb.addWidget(window_size_btn)
@@ -178,9 +254,17 @@ class MainWindow(QMainWindow):
 
     # ------------------------------------------------------------------
 
+    def rank_filter_dialog(self, kind, title):
+        val, ok = QInputDialogWithInt.getInt(
+            self, title, "Radius (1..50):", 2, 1, 50, 1)
+        if ok:
+            self.canvas.apply_rank_filter(kind, val)
+
+    # ------------------------------------------------------------------
+
     def load_image(self):
         path, _ = QFileDialog.getOpenFileName(
-            self, "Open image", "", "Images (*.png *.jpg *.bmp *.gif)")
+            self, "Open image", "", "Images (*.png *.jpg *.bmp *.gif);;Raw Pixels (*.npy)")
         if path:
             self.canvas.load_image(path)
 
@@ -188,7 +272,7 @@ class MainWindow(QMainWindow):
 
     def save_image(self):
         path, selected_filter = QFileDialog.getSaveFileName(self,"Save image","",
-            "PNG Image (*.png);;JPEG Image (*.jpg *.jpeg);;BMP Image (*.bmp)")
+            "PNG Image (*.png);;JPEG Image (*.jpg *.jpeg);;BMP Image (*.bmp);;Raw Pixels (*.npy)")
         if not path:
             return
 
@@ -201,6 +285,8 @@ class MainWindow(QMainWindow):
                 path += ".jpg"
             elif "BMP" in selected_filter:
                 path += ".bmp"
+            elif "Raw" in selected_filter:
+                path += ".npy"
 
         self.canvas.save_image(path)
 
@@ -223,4 +309,47 @@ class MainWindow(QMainWindow):
         if not ok2:
             return
 
-        self.canvas.set_canvas_size(w, h)
\ No newline at end of file
+        self.canvas.set_canvas_size(w, h)
+
+    def resize_image_dialog(self):
+        current_w = self.canvas.image.width()
+        current_h = self.canvas.image.height()
+
+        w, ok1 = QInputDialog.getInt(
+            self, "Resize Image", "New width:", current_w, 1, 10000)
+        if not ok1:
+            return
+
+        h, ok2 = QInputDialog.getInt(
+            self, "Resize Image", "New height:", current_h, 1, 10000)
+        if not ok2:
+            return
+
+        method, ok3 = QInputDialog.getItem(
+            self, "Resize Image", "Filter:", ["Lanczos", "Bicubic", "Bilinear", "Nearest"], 0, False)
+        if not ok3:
+            return
+
+        self.canvas.resize_image(w, h, method.lower())
+
+    # ------------------------------------------------------------------
+
+    def update_memory_status(self):
+        from memory import status_text
+        self.memory_label.setText(status_text(self.canvas.memory_usage(), self.canvas.memory_budget))
+
+    def memory_budget_dialog(self):
+        val, ok = QInputDialogWithInt.getInt(
+            self, "Memory Budget", "Budget in MB (64..65536):",
+            self.canvas.memory_budget // (1024 * 1024), 64, 65536, 64)
+        if ok:
+            self.canvas.set_memory_budget(val * 1024 * 1024)
+
+    def show_memory_report(self):
+        text = self.canvas.memory_report()
+        print(text, file=sys.stderr)
+
+        box = QMessageBox(self)
+        box.setWindowTitle("Memory Report")
+        box.setText("<pre>%s</pre>" % text)
+        box.exec_()
\ No newline at end of file
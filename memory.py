@@ -0,0 +1,54 @@
+import sys
+
+# Rough per-item cost of a TextItem's QFont / QColor / QPoint / QRect wrappers
+TEXT_ITEM_OVERHEAD = 256
+
+# Subsystems in the order they are listed
+SUBSYSTEMS = ("image", "undo", "redo", "temporaries", "filter cache")
+
+
+def image_bytes(img, seen=None):
+    # `seen` collects cache keys so implicitly shared images count once
+    if img is None or img.isNull():
+        return 0
+    if seen is not None:
+        if img.cacheKey() in seen:
+            return 0
+        seen.add(img.cacheKey())
+    return img.sizeInBytes()
+
+
+def text_items_bytes(items):
+    return sum(sys.getsizeof(item.text) + TEXT_ITEM_OVERHEAD for item in items)
+
+
+def state_bytes(state, seen=None):
+    # One undo / redo entry: (image, text items)
+    img, items = state
+    return image_bytes(img, seen) + text_items_bytes(items)
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return "%d %s" % (n, unit) if unit == "B" else "%.1f %s" % (n, unit)
+        n /= 1024.0
+
+
+def status_text(usage, budget):
+    parts = ["%s %s" % (name, format_bytes(usage[name])) for name in SUBSYSTEMS]
+    return "Memory %s / %s  |  %s" % (
+        format_bytes(sum(usage.values())), format_bytes(budget), ", ".join(parts))
+
+
+def report(usage, budget, details):
+    total = sum(usage.values())
+    lines = ["%-14s %12s %6s" % ("subsystem", "bytes", "%")]
+    for name in SUBSYSTEMS:
+        share = 100.0 * usage[name] / total if total else 0.0
+        lines.append("%-14s %12s %5.1f%%" % (name, format_bytes(usage[name]), share))
+    lines.append("%-14s %12s" % ("total", format_bytes(total)))
+    lines.append("%-14s %12s" % ("budget", format_bytes(budget)))
+    lines.append("")
+    lines.extend("%s: %s" % (k, v) for k, v in details.items())
+    return "\n".join(lines)
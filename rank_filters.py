@@ -0,0 +1,116 @@
+import numpy as np
+
+
+# Above this radius the median keeps dense per-column histograms, whose cost
+# does not depend on the radius; below it sliding the window histograms
+# down the image (Huang) touches fewer bins.
+MEDIAN_SPARSE_MAX_RADIUS = 12
+
+
+def median_filter(arr, radius):
+    out = arr.copy()
+    for c in range(arr.shape[2]):
+        plane = arr[..., c]
+        # Flat channels (usually alpha) have nothing to filter
+        if plane.min() != plane.max():
+            out[..., c] = _median_plane(plane, radius)
+    return out
+
+
+def min_filter(arr, radius):
+    out = _van_herk(_van_herk(arr, radius, 0, np.minimum), radius, 1, np.minimum)
+    return np.ascontiguousarray(out)
+
+
+def max_filter(arr, radius):
+    out = _van_herk(_van_herk(arr, radius, 0, np.maximum), radius, 1, np.maximum)
+    return np.ascontiguousarray(out)
+
+
+def _van_herk(arr, r, axis, op):
+    # 1-D running min/max over 2r+1 samples in three comparisons per sample
+    # whatever the radius (van Herk / Gil-Werman): split the edge-padded line
+    # into blocks of the window length, take a running op forwards and
+    # backwards inside each block and combine the two at the window ends.
+    k = 2 * r + 1
+    a = np.moveaxis(arr, axis, 0)
+    n = a.shape[0]
+    blocks = -(-(n + 2 * r) // k)
+    pad = [(0, 0)] * a.ndim
+    pad[0] = (r, blocks * k - n - r)
+    p = np.pad(a, pad, mode="edge").reshape((blocks, k) + a.shape[1:])
+
+    fwd = op.accumulate(p, axis=1).reshape((blocks * k,) + a.shape[1:])
+    bwd = op.accumulate(p[:, ::-1], axis=1)[:, ::-1].reshape((blocks * k,) + a.shape[1:])
+    return np.moveaxis(op(bwd[:n], fwd[k - 1:k - 1 + n]), 0, axis)
+
+
+def _median_plane(plane, r):
+    h, w = plane.shape
+    k = 2 * r + 1
+    half = k * k // 2 + 1
+    dt = np.uint16 if k * k < 65536 else np.uint32
+    p = np.pad(plane, r, mode="edge").astype(np.intp)
+    out = np.empty((h, w), dtype=np.uint8)
+
+    if r <= MEDIAN_SPARSE_MAX_RADIUS:
+        # Window histograms for every column of the current output row, with
+        # 16 coarse bins on the side; moving down a row adds the k entering
+        # and removes the k leaving pixels of each window.
+        fine = np.zeros((w, 256), dtype=dt)
+        coarse = np.zeros((w, 16), dtype=dt)
+        fine_idx = np.arange(w) * 256
+        coarse_idx = np.arange(w) * 16
+        fflat, cflat = fine.reshape(-1), coarse.reshape(-1)
+
+        def add_row(row, inc):
+            for d in range(k):
+                v = row[d:d + w]
+                if inc:
+                    fflat[fine_idx + v] += 1
+                    cflat[coarse_idx + (v >> 4)] += 1
+                else:
+                    fflat[fine_idx + v] -= 1
+                    cflat[coarse_idx + (v >> 4)] -= 1
+
+        for y in range(k - 1):
+            add_row(p[y], True)
+        for y in range(h):
+            add_row(p[y + k - 1], True)
+            out[y] = _histogram_median(fine, coarse, half)
+            add_row(p[y], False)
+        return out
+
+    # One histogram per padded column over the k rows of the window; the
+    # window histograms are differences of their running sums along the row.
+    # The running sums may wrap around, their differences are still exact.
+    wp = w + 2 * r
+    cols = np.arange(wp)
+    fine = np.zeros((wp, 256), dtype=dt)
+    coarse = np.zeros((wp, 16), dtype=dt)
+    fsum = np.zeros((wp + 1, 256), dtype=dt)
+    csum = np.zeros((wp + 1, 16), dtype=dt)
+
+    for y in range(k - 1):
+        fine[cols, p[y]] += 1
+        coarse[cols, p[y] >> 4] += 1
+    for y in range(h):
+        fine[cols, p[y + k - 1]] += 1
+        coarse[cols, p[y + k - 1] >> 4] += 1
+        np.cumsum(fine, axis=0, dtype=dt, out=fsum[1:])
+        np.cumsum(coarse, axis=0, dtype=dt, out=csum[1:])
+        out[y] = _histogram_median(fsum[k:] - fsum[:-k], csum[k:] - csum[:-k], half)
+        fine[cols, p[y]] -= 1
+        coarse[cols, p[y] >> 4] -= 1
+    return out
+
+
+def _histogram_median(fine, coarse, half):
+    # Value of rank `half` in each row of `fine`, found through the coarse
+    # bins first so only 16 fine bins per row are scanned
+    idx = np.arange(len(coarse))
+    cc = np.cumsum(coarse, axis=1)
+    b = (cc < half).sum(axis=1)
+    below = cc[idx, b] - coarse[idx, b]
+    fc = np.cumsum(fine.reshape(-1, 16, 16)[idx, b], axis=1) + below[:, None]
+    return b * 16 + (fc < half).sum(axis=1)
@@ -0,0 +1,121 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from global_variables import RESAMPLE_BAND
+
+
+def _box(x):
+    return ((x >= -0.5) & (x < 0.5)).astype(np.float32)
+
+
+def _triangle(x):
+    return np.maximum(0.0, 1.0 - np.abs(x))
+
+
+def _cubic(x, a=-0.5):
+    x = np.abs(x)
+    near = ((a + 2.0) * x - (a + 3.0)) * x * x + 1.0
+    far = ((a * x - 5.0 * a) * x + 8.0 * a) * x - 4.0 * a
+    return np.where(x <= 1.0, near, np.where(x < 2.0, far, 0.0))
+
+
+def _lanczos3(x):
+    return np.where(np.abs(x) < 3.0, np.sinc(x) * np.sinc(x / 3.0), 0.0)
+
+
+# name -> (support radius in source pixels, kernel)
+FILTERS = {
+    "nearest": (0.5, _box),
+    "bilinear": (1.0, _triangle),
+    "bicubic": (2.0, _cubic),
+    "lanczos": (3.0, _lanczos3),
+}
+
+_pool = None
+_background = None
+
+
+def _workers():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _pool
+
+
+def weight_table(n_in, n_out, method):
+    # Source indices and normalised weights of every output sample along one
+    # axis, both shaped (n_out, taps)
+    support, kernel = FILTERS[method]
+    scale = n_in / n_out
+    center = (np.arange(n_out) + 0.5) * scale
+
+    if method == "nearest":
+        idx = np.minimum(center.astype(np.intp), n_in - 1)[:, None]
+        return idx, np.ones((n_out, 1), dtype=np.float32)
+
+    # Stretch the kernel when shrinking so every source pixel contributes
+    stretch = max(scale, 1.0)
+    radius = support * stretch
+    taps = int(np.ceil(radius)) * 2 + 1
+    left = np.floor(center - radius).astype(np.intp)
+    idx = left[:, None] + np.arange(taps)
+
+    w = kernel((idx + 0.5 - center[:, None]) / stretch).astype(np.float32)
+    w /= w.sum(axis=1, keepdims=True)
+    return np.clip(idx, 0, n_in - 1), w
+
+
+def _bands(n):
+    return [(i, min(n, i + RESAMPLE_BAND)) for i in range(0, n, RESAMPLE_BAND)]
+
+
+def resize(arr, w, h, method="bilinear"):
+    # Separable resize of an (H, W, C) uint8 image: a horizontal then a
+    # vertical pass, each split into row bands on the worker pool. Images
+    # with transparency (BGRA) are filtered premultiplied, so the colour of
+    # transparent pixels doesn't bleed into their neighbours.
+    src_h, src_w, ch = arr.shape
+    premultiply = ch == 4 and arr[..., 3].min() < 255
+    xi, xw = weight_table(src_w, w, method)
+    yi, yw = weight_table(src_h, h, method)
+
+    tmp = np.empty((src_h, w, ch), dtype=np.float32)
+    out = np.empty((h, w, ch), dtype=np.uint8)
+
+    def horizontal(band):
+        y0, y1 = band
+        rows = arr[y0:y1]
+        if premultiply:
+            rows = rows.astype(np.float32)
+            rows[..., :3] *= rows[..., 3:] / 255.0
+        acc = np.zeros((y1 - y0, w, ch), dtype=np.float32)
+        for t in range(xi.shape[1]):
+            acc += rows[:, xi[:, t]] * xw[None, :, t, None]
+        tmp[y0:y1] = acc
+
+    def vertical(band):
+        y0, y1 = band
+        acc = np.zeros((y1 - y0, w, ch), dtype=np.float32)
+        for t in range(yi.shape[1]):
+            acc += tmp[yi[y0:y1, t]] * yw[y0:y1, t, None, None]
+        if premultiply:
+            alpha = acc[..., 3:]
+            np.divide(acc[..., :3] * 255.0, alpha, out=acc[..., :3], where=alpha > 0)
+        np.clip(acc + 0.5, 0, 255, out=acc)
+        out[y0:y1] = acc
+
+    pool = _workers()
+    list(pool.map(horizontal, _bands(src_h)))
+    list(pool.map(vertical, _bands(h)))
+    return out
+
+
+def resize_async(arr, w, h, method="bilinear"):
+    # Runs resize() off the calling thread and returns a Future. The driver
+    # gets its own thread so it never waits on a band queued behind itself.
+    global _background
+    if _background is None:
+        _background = ThreadPoolExecutor(max_workers=1)
+    return _background.submit(resize, arr, w, h, method)
@@ -0,0 +1,29 @@
+import numpy as np
+from PyQt5.QtGui import QImage
+
+
+class Selection:
+    # Pixel selection stored as a bitmask packed 8 pixels per byte along rows
+    def __init__(self, mask):
+        self.height, self.width = mask.shape
+        self.bits = np.packbits(mask, axis=1)
+        self.overlay_image = None
+
+    def mask(self, w=None, h=None):
+        m = np.unpackbits(self.bits, axis=1, count=self.width).view(bool)
+        if w is None or (w, h) == (self.width, self.height):
+            return m
+
+        # Canvas was resized since the selection was made
+        out = np.zeros((h, w), dtype=bool)
+        ch, cw = min(h, self.height), min(w, self.width)
+        out[:ch, :cw] = m[:ch, :cw]
+        return out
+
+    def overlay(self, color=(255, 120, 0, 90)):
+        # Translucent BGRA tint over the selected pixels, built once per selection
+        if self.overlay_image is None:
+            arr = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+            arr[self.mask()] = (color[2], color[1], color[0], color[3])
+            self.overlay_image = QImage(arr.data, self.width, self.height, QImage.Format_ARGB32).copy()
+        return self.overlay_image